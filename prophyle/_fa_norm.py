@@ -12,16 +12,14 @@ import sys
 
 reg_splitting = re.compile("[^ACGT]")
 
-comp_dict = {
-    "A": "T",
-    "C": "G",
-    "G": "C",
-    "T": "A",
-}
+# translation table (str.translate runs in C, no per-character dict lookups)
+comp_table = str.maketrans("ACGT", "TGCA")
+# deletion table: a string is DNA iff nothing remains after the translation
+nondna_table = str.maketrans("", "", "ACGT")
 
 
 def reverse_complement_str(dna):
-    reverse_complement = "".join([comp_dict[x] for x in dna[::-1]])
+    reverse_complement = dna[::-1].translate(comp_table)
     return reverse_complement
 
 
@@ -70,7 +68,7 @@ if __name__ == "__main__":
     contigs_canonical = []
     for c in contigs:
         cf = c.upper()
-        assert set(cf).issubset(set(["A", "C", "G", "T"]))
+        assert not cf.translate(nondna_table)
         cr = reverse_complement_str(c)
         contigs_canonical.append(min(cf, cr))
 
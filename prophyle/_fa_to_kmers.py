@@ -12,16 +12,12 @@ import sys
 
 reg_splitting = re.compile("[^ACGT]")
 
-comp_dict = {
-    "A": "T",
-    "C": "G",
-    "G": "C",
-    "T": "A",
-}
+# translation table (str.translate runs in C, no per-character dict lookups)
+comp_table = str.maketrans("ACGT", "TGCA")
 
 
 def reverse_complement_str(dna):
-    reverse_complement = "".join([comp_dict[x] for x in dna[::-1]])
+    reverse_complement = dna[::-1].translate(comp_table)
     return reverse_complement
 
 
@@ -68,9 +64,12 @@ def get_kmers_from_fasta(fasta_fn, k, mode="a"):
         sequences_ok = reg_splitting.split(sequence)
         for seq in sequences_ok:
             if mode == "c":
-                for i in range(len(seq) - k + 1):
+                # the reverse complement is computed once per sequence, not per k-mer
+                seq_rc = reverse_complement_str(seq)
+                n = len(seq)
+                for i in range(n - k + 1):
                     kmer = seq[i:i + k]
-                    kmer_rc = reverse_complement_str(kmer)
+                    kmer_rc = seq_rc[n - i - k:n - i]
                     set_of_kmers.add(min(kmer, kmer_rc))
 
             else:
@@ -22,9 +22,13 @@ Example:
 
 import argparse
 import collections
+import concurrent.futures
+import functools
+import glob
 import hashlib
-import multiprocessing
 import os
+import shutil
+import stat
 import sys
 import tarfile
 import tempfile
@@ -73,7 +77,7 @@ else:
     SPLIT_FA = "prophyle_split_allseq.py"
 
 DEFAULT_K = 31
-DEFAULT_THREADS = multiprocessing.cpu_count()
+DEFAULT_THREADS = pro.cpu_count()
 # DEFAULT_THREADS=1
 DEFAULT_MEASURE = 'h1'
 DEFAULT_OUTPUT_FORMAT = 'sam'
@@ -100,9 +104,12 @@ FILES_TO_ARCHIVE = [
 ]
 
 
-def _file_md5(fn, block_size=2**20):
-    md5 = hashlib.md5()
+def _file_md5(fn, block_size=2**23):
     with open(fn, 'rb') as f:
+        # Python >= 3.11: the whole loop runs in C
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(f, 'md5').hexdigest()
+        md5 = hashlib.md5()
         while True:
             data = f.read(block_size)
             if not data:
@@ -111,20 +118,51 @@ def _file_md5(fn, block_size=2**20):
     return md5.hexdigest()
 
 
+# md5 checksums are computed in background threads, overlapping with the next steps
+# (the pool is created on first use, most subcommands never compute a checksum)
+_md5_executor = None
+# files waiting for logging their md5 checksums
+_md5_queue = []
+
+
 def _log_file_md5(fn, remark=None):
-    md5 = _file_md5(fn)
+    """Start computing md5 checksum of a file in background (the checksum is logged by _flush_file_md5).
+
+    Args:
+        fn (str): File name.
+        remark (str): Remark to be printed after the file name.
+    """
+    global _md5_executor
+    if _md5_executor is None:
+        _md5_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
     size = pro.file_sizes(fn)[0]
-    m = "File {}{} has md5 checksum {} and size {} B".format(
-        os.path.basename(fn),
-        " ({})".format(remark) if remark is not None else "",
-        md5,
-        size,
-    )
-    pro.message(m, only_log=True)
+    _md5_queue.append((fn, remark, size, _md5_executor.submit(_file_md5, fn)))
+
+
+def _flush_file_md5():
+    """Wait for the md5 checksums of all queued files and log them.
+
+    Must be called before any of the queued files is modified or removed. The checksums are logged
+    in the order in which the files were queued, but only at this point (i.e., after the messages
+    of the steps which have run in the meantime).
+    """
+    for fn, remark, size, future in _md5_queue:
+        m = "File {}{} has md5 checksum {} and size {} B".format(
+            os.path.basename(fn),
+            " ({})".format(remark) if remark is not None else "",
+            future.result(),
+            size,
+        )
+        pro.message(m, only_log=True)
+    del _md5_queue[:]
+
+
+# trees which have already been validated, identified by (path, mtime, size)
+_valid_trees = set()
 
 
 def _test_tree(fn):
-    """Test if given tree is valid for ProPhyle.
+    """Test if given tree is valid for ProPhyle. The tree is not parsed again if it has already been validated.
 
     Args:
         fn (str): Newick/NHX tree.
@@ -132,8 +170,33 @@ def _test_tree(fn):
     Raises:
         AssertionError: The tree is not valid.
     """
+    st = os.stat(fn)
+    key = (os.path.abspath(fn), st.st_mtime_ns, st.st_size)
+    if key in _valid_trees:
+        return
     tree = pro.load_nhx_tree(fn, validate=False)
     assert pro.validate_prophyle_nhx_tree(tree, verbose=True, throw_exceptions=False, output_fo=sys.stderr)
+    _valid_trees.add(key)
+
+
+def _prophyle_bin_up_to_date():
+    """Test if all ProPhyle binaries exist and are newer than their sources and Makefiles.
+
+    Returns:
+        bool: True if running make is not needed.
+    """
+    try:
+        oldest_bin = min(os.stat(fn).st_mtime for fn in (IND, ASM, BWA, C_ASSIGN))
+    except FileNotFoundError:
+        return False
+
+    for d in [os.path.join(C_D, x) for x in ("prophyle_index", "prophyle_assembler", "prophyle_assignment")]:
+        for dirpath, _, filenames in os.walk(d):
+            for fn in filenames:
+                if fn == "Makefile" or fn.endswith((".c", ".cpp", ".h")):
+                    if os.stat(os.path.join(dirpath, fn)).st_mtime > oldest_bin:
+                        return False
+    return True
 
 
 def _compile_prophyle_bin(clean=False, parallel=False, silent=True, force=False):
@@ -146,6 +209,10 @@ def _compile_prophyle_bin(clean=False, parallel=False, silent=True, force=False)
         force (bool): Force recompile (make -B).
     """
 
+    # make would have nothing to do
+    if not clean and not force and _prophyle_bin_up_to_date():
+        return
+
     try:
         command = ["make"]
 
@@ -202,9 +269,25 @@ def __mark_fn(d, i, name):
         name (str): Name of the mark.
     """
     if name is None:
-        return os.path.join(d, ".complete.{}".format(i))
+        return "{}/.complete.{}".format(d, i)
     else:
-        return os.path.join(d, ".complete.{}.{}".format(name, i))
+        return "{}/.complete.{}.{}".format(d, name, i)
+
+
+@functools.lru_cache(maxsize=256)
+def _mark_mtime(fn):
+    """Get the modification time of a mark file (cached, the cache is cleared by _mark_complete).
+
+    Args:
+        fn (str): Mark file.
+
+    Returns:
+        float: Modification time or None if the mark does not exist.
+    """
+    try:
+        return os.stat(fn).st_mtime
+    except FileNotFoundError:
+        return None
 
 
 def _mark_complete(d, i=1, name=None):
@@ -219,6 +302,7 @@ def _mark_complete(d, i=1, name=None):
     assert i > 0
 
     pro.touch(__mark_fn(d, i, name))
+    _mark_mtime.cache_clear()
 
 
 def _is_complete(d, i=1, name=None, dont_check_previous=False):
@@ -234,10 +318,15 @@ def _is_complete(d, i=1, name=None, dont_check_previous=False):
     fn = __mark_fn(d, i, name)
     fn0 = __mark_fn(d, i - 1, name)
 
+    mtime = _mark_mtime(fn)
+
     if i == 1 or dont_check_previous:
-        return os.path.isfile(fn)
+        return mtime is not None
     else:
-        return pro.existing_and_newer(fn0, fn)
+        # same as pro.existing_and_newer(fn0, fn), but with cached mtimes
+        mtime0 = _mark_mtime(fn0)
+        assert mtime0 is not None, "Dependency '{}' does not exist".format(fn0)
+        return mtime is not None and mtime0 <= mtime
 
 
 def _missing_library(d):
@@ -273,22 +362,49 @@ def _pseudo_fai(d):
     else:
         pro.message("Generating pseudofai for library '{}'".format(l))
         assert d[-1] != "/"
-        # cmd=['grep -r --include=\\*.{fa,ffn,fna}', '">"', d, '| sed "s/:>/\t/"']
-        cmd = [
-            'find', d, '-name', "'*.fa'", "-o", "-name", "'*.ffn'", "-o", "-name", "'*.fna'", "-exec", "grep", "-H",
-            '">"', "{}", "\\;", "|", 'sed', '"s/\:>/\t/"'
-        ]
-
-        pro.run_safe(cmd, output_fn=pseudofai_fn)
+        # scanned in a single process (no grep forked per FASTA file)
+        with open(pseudofai_fn, "w+") as f:
+            for dirpath, _, filenames in os.walk(d):
+                for fn in filenames:
+                    if not fn.endswith((".fa", ".ffn", ".fna")):
+                        continue
+                    fa_fn = os.path.join(dirpath, fn)
+                    with open(fa_fn) as fa:
+                        for x in fa:
+                            if x[0] == ">":
+                                f.write("{}\t{}\n".format(fa_fn, x[1:].rstrip("\n")))
         _mark_complete(d, 2)
 
 
-def prophyle_download(library, library_dir, force=False):
+def _download_tgz_cmd(url, cmd_untar):
+    """Create a shell command for downloading and extracting a .tar.gz archive into the current directory.
+
+    Args:
+        url (str): URL of the archive.
+        cmd_untar (list): Command extracting the archive from the standard input.
+
+    Returns:
+        list: Command.
+    """
+    if shutil.which('aria2c') is not None:
+        # multiple connections; aria2c cannot write to stdout, the archive is extracted from a temporary file
+        fn = os.path.basename(url)
+        # the archive is removed also if the download or the extraction fails
+        return [
+            '(', 'trap', 'rm -f {}'.format(fn), 'EXIT', ';', 'aria2c', '-x', 16, '-s', 16, '--allow-overwrite=true',
+            '-o', fn, url, '&&', 'cat', fn, '|'
+        ] + cmd_untar + [')']
+    else:
+        return ['curl', '--retry', 5, '--retry-delay', 2, url, '|'] + cmd_untar
+
+
+def prophyle_download(library, library_dir, force=False, threads=DEFAULT_THREADS):
     """Create a library Download genomic library and copy the corresponding tree.
 
     Args:
         library (str): Library to download (bacteria / viruses / ...)
         library_dir (str): Directory where download files will be downloaded.
+        threads (int): Number of threads for decompression (split among the libraries for 'all').
 
     TODO:
         * Add support for alternative URLs (http / ftp, backup refseq sites, etc.).
@@ -297,8 +413,22 @@ def prophyle_download(library, library_dir, force=False):
     """
 
     if library == "all":
-        for l in LIBRARIES:
-            prophyle_download(l, library_dir, force)
+        # the downloads are latency-bound, so the libraries are downloaded concurrently
+        # the decompression threads are split among the libraries (not to oversubscribe the CPUs)
+        lib_threads = max(1, threads // len(LIBRARIES))
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(LIBRARIES))
+        futures = [executor.submit(prophyle_download, l, library_dir, force, lib_threads) for l in LIBRARIES]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+        except BaseException:
+            # re-raise the first exception; the downloads which have not started yet are cancelled,
+            # the running ones cannot be interrupted and are still finished before the interpreter exits
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+            raise
+        executor.shutdown()
         return
     else:
         assert library in LIBRARIES
@@ -314,12 +444,24 @@ def prophyle_download(library, library_dir, force=False):
     #pro.message("Checking library '{}' in '{}'".format(library, d))
     lib_missing = _missing_library(d)
 
+    # decompress in parallel if possible
+    # ownership and permissions from the archive are not restored (no chown/chmod per extracted file)
+    tar_flags = ['--no-same-owner', '--no-same-permissions']
+    if shutil.which('pigz') is not None:
+        cmd_untar = ['pigz', '-dc', '-p', threads, '|', 'tar', '-x'] + tar_flags
+    else:
+        cmd_untar = ['tar', '-xz'] + tar_flags
+    if shutil.which('lbzip2') is not None:
+        cmd_bunzip = ['lbzip2', '-dc', '-n', threads]
+    else:
+        cmd_bunzip = ['bzip2', '-d']
+
     if library == 'bacteria':
         if lib_missing or force:
             cmd = [
-                'cd', d + "/..", '&&', 'curl', '-O', ZENODO_URL + '/files/bacteria.nw', '&&', 'curl',
-                ZENODO_URL + '/files/bacteria.tar.gz', '|', 'tar', 'xz'
-            ]
+                'cd', d + "/..", '&&', 'curl', '--retry', 5, '--retry-delay', 2, '-O', ZENODO_URL + '/files/bacteria.nw',
+                '&&'
+            ] + _download_tgz_cmd(ZENODO_URL + '/files/bacteria.tar.gz', cmd_untar)
             pro.run_safe(cmd)
             _mark_complete(d, 1)
         # _pseudo_fai(d)
@@ -327,9 +469,9 @@ def prophyle_download(library, library_dir, force=False):
     elif library == 'viruses':
         if lib_missing or force:
             cmd = [
-                'cd', d + "/..", '&&', 'curl', '-O', ZENODO_URL + '/files/viruses.nw', '&&', 'curl',
-                ZENODO_URL + '/files/viruses.tar.gz', '|', 'tar', 'xz'
-            ]
+                'cd', d + "/..", '&&', 'curl', '--retry', 5, '--retry-delay', 2, '-O', ZENODO_URL + '/files/viruses.nw',
+                '&&'
+            ] + _download_tgz_cmd(ZENODO_URL + '/files/viruses.tar.gz', cmd_untar)
             pro.run_safe(cmd)
             _mark_complete(d, 1)
         # _pseudo_fai(d)
@@ -337,9 +479,9 @@ def prophyle_download(library, library_dir, force=False):
     elif library == 'plasmids':
         if lib_missing or force:
             cmd = [
-                'cd', d + "/..", '&&', 'curl', '-O', ZENODO_URL + '/files/plasmids.nw', '&&', 'curl',
-                ZENODO_URL + '/files/plasmids.tar.gz', '|', 'tar', 'xz'
-            ]
+                'cd', d + "/..", '&&', 'curl', '--retry', 5, '--retry-delay', 2, '-O', ZENODO_URL + '/files/plasmids.nw',
+                '&&'
+            ] + _download_tgz_cmd(ZENODO_URL + '/files/plasmids.tar.gz', cmd_untar)
             pro.run_safe(cmd)
             _mark_complete(d, 1)
         # _pseudo_fai(d)
@@ -348,10 +490,9 @@ def prophyle_download(library, library_dir, force=False):
         if lib_missing or force:
             # fix when error appears
             cmd = [
-                'cd', d, '&&', 'curl', 'http://downloads.hmpdacc.org/data/HMREFG/all_seqs.fa.bz2', '|', 'bzip2', '-d',
-                '|', SPLIT_FA,
-                os.path.abspath(d)
-            ]
+                'cd', d, '&&', 'curl', '--retry', 5, '--retry-delay', 2,
+                'http://downloads.hmpdacc.org/data/HMREFG/all_seqs.fa.bz2', '|'
+            ] + cmd_bunzip + ['|', SPLIT_FA, os.path.abspath(d)]
             pro.run_safe(cmd)
             _mark_complete(d, 1)
         # _pseudo_fai(d)
@@ -440,15 +581,21 @@ def _kmer_stats(index_dir):
         index_dir (str): Index directory.
     """
     propagation_dir = os.path.join(index_dir, 'propagation')
-    command = [
-        "cat", propagation_dir + "/*.count.tsv", "|", "grep", "-v", "^#", "|", "sort", "|", "uniq", ">",
-        os.path.join(index_dir, "index.fa.kmers.tsv")
-    ]
-    pro.run_safe(
-        command,
-        err_msg="A file with k-mer statistics could not be created.",
-        thr_exc=False,
-    )
+    kmers_tsv_fn = os.path.join(index_dir, "index.fa.kmers.tsv")
+    pro.message("Creating a file with k-mer statistics '{}'".format(kmers_tsv_fn))
+    # removing duplicates using a set (instead of 'sort | uniq'), only the (small) final set is sorted;
+    # lines are sorted by code points (i.e., as 'LC_ALL=C sort'), independently of the locale
+    try:
+        lines = set()
+        for count_fn in glob.glob(os.path.join(propagation_dir, "*.count.tsv")):
+            with open(count_fn) as f:
+                lines.update(x for x in f if x[0] != "#")
+        with open(kmers_tsv_fn, "w+") as f:
+            f.writelines(sorted(lines))
+    except OSError as e:
+        # fatal as the original 'run_safe(..., thr_exc=False)' of 'sort | uniq'
+        print("Error: A file with k-mer statistics could not be created ({}).".format(e), file=sys.stderr)
+        sys.exit(1)
 
 
 def _propagation_preprocessing(in_trees, out_tree, no_prefixes, sampling_rate, autocomplete):
@@ -508,12 +655,13 @@ def _propagation_postprocessing(index_dir, in_tree_fn, out_tree_fn):
     tsv_fn = os.path.join(index_dir, "index.fa.kmers.tsv")
     index_fa = os.path.join(index_dir, "index.fa")
 
-    command = ["cat", os.path.join(propagation_dir, "*.tsv"), '>', tsv_fn]
-    pro.run_safe(
-        command,
-        err_msg="K-mer statistics could not be created.",
-        thr_exc=True,
-    )
+    # concatenate the TSV files in Python (no cat process); os.sendfile is not used
+    # since on macOS it can write only to sockets
+    pro.message("Concatenating k-mer statistics into '{}'".format(tsv_fn))
+    with open(tsv_fn, "wb") as out_fo:
+        for in_fn in sorted(glob.glob(os.path.join(propagation_dir, "*.tsv"))):
+            with open(in_fn, "rb") as in_fo:
+                shutil.copyfileobj(in_fo, out_fo, 2**23)
 
     command = [PROPAGATION_POSTPROCESSING, propagation_dir, index_fa, in_tree_fn, tsv_fn, out_tree_fn]
     pro.run_safe(
@@ -572,6 +720,8 @@ def _bwt2bwtocc(fa_fn):
 
     #pro.message('Generating sampled OCC array')
     pro.test_files(BWA, fa_fn + ".bwt")
+    # the BWT file is updated in place
+    _flush_file_md5()
     command = [BWA, 'bwtupdate', fa_fn + ".bwt"]
     pro.run_safe(
         command,
@@ -671,139 +821,147 @@ def prophyle_index(
     index_tree_1 = os.path.join(index_dir, 'tree.preliminary.nw')
     index_tree_2 = os.path.join(index_dir, 'tree.nw')
 
-    # recompute = recompute everything from now on
-    # force==True => start to recompute everything from beginning
-    recompute = force
-
-    # make index dir
-    pro.makedirs(index_dir)
-
-    #
-    # 1) Newick
-    #
-
-    #if not _is_complete(index_dir, 1) or not pro.existing_and_newer_list(trees_fn, index_tree_1):
-    if not _is_complete(index_dir, 1):
-        recompute = True
-
-    if recompute:
-        pro.message('[1/6] Copying/merging trees', upper=True)
-        for tree_fn in trees_fn:
-            tree_fn, _, root = tree_fn.partition("@")
-            tree = pro.load_nhx_tree(tree_fn, validate=False)
-            # postpone for autocomplete
-            if not autocomplete:
-                pro.validate_prophyle_nhx_tree(tree)
-            if root != "":
-                assert len(tree.search_nodes(name=root)) != 0, "Node '{}' does not exist in '{}'.".format(root, tree_fn)
-        if len(trees_fn) != 1:
-            pro.message('Merging {} trees'.format(len(trees_fn)))
-        _propagation_preprocessing(
-            trees_fn, index_tree_1, no_prefixes=no_prefixes, sampling_rate=sampling_rate, autocomplete=autocomplete
-        )
-        _test_tree(index_tree_1)
-        _mark_complete(index_dir, 1)
-    else:
-        pro.message('[1/6] Tree already exists, skipping its creation', upper=True)
-
-    #
-    # 2) Create and run Makefile for propagation, and merge FASTA files
-    #
-
-    if not _is_complete(index_dir, 2):
-        recompute = True
-
-    if recompute:
-        pro.message('[2/6] Running k-mer propagation', upper=True)
-        _create_makefile(index_dir, k, library_dir, mask_repeats=mask_repeats)
-        _propagate(index_dir, threads=threads)
-        _propagation_postprocessing(index_dir, index_tree_1, index_tree_2)
-        _test_tree(index_tree_2)
-        _kmer_stats(index_dir)
-        if not keep_tmp_files:
-            _remove_tmp_propagation_files(index_dir)
-        else:
-            pro.message('Keeping temporary files')
-        _mark_complete(index_dir, 2)
-    else:
-        pro.message('[2/6] K-mers have already been propagated, skipping propagation', upper=True)
+    # the checksums queued so far are logged also if a step fails
+    try:
+        # recompute = recompute everything from now on
+        # force==True => start to recompute everything from beginning
+        recompute = force
 
-    #
-    # 3) BWT
-    #
+        # make index dir
+        pro.makedirs(index_dir)
 
-    if not _is_complete(index_dir, 3) and not _is_complete(index_dir, 4, dont_check_previous=True):
-        recompute = True
+        #
+        # 1) Newick
+        #
 
-    if recompute:
-        pro.message('[3/6] Constructing BWT', upper=True)
-        pro.rm(index_fa + '.bwt', index_fa + '.bwt.complete')
-        _fa2pac(index_fa)
-        _pac2bwt(index_fa)
-        _mark_complete(index_dir, 3)
-    else:
-        pro.message('[3/6] BWT already exists, skipping its construction', upper=True)
+        #if not _is_complete(index_dir, 1) or not pro.existing_and_newer_list(trees_fn, index_tree_1):
+        if not _is_complete(index_dir, 1):
+            recompute = True
 
-    #
-    # 3) OCC
-    #
+        if recompute:
+            pro.message('[1/6] Copying/merging trees', upper=True)
+            for tree_fn in trees_fn:
+                tree_fn, _, root = tree_fn.partition("@")
+                tree = pro.load_nhx_tree(tree_fn, validate=False)
+                # postpone for autocomplete
+                if not autocomplete:
+                    pro.validate_prophyle_nhx_tree(tree)
+                if root != "":
+                    assert len(tree.search_nodes(name=root)) != 0, "Node '{}' does not exist in '{}'.".format(
+                        root, tree_fn
+                    )
+            if len(trees_fn) != 1:
+                pro.message('Merging {} trees'.format(len(trees_fn)))
+            _propagation_preprocessing(
+                trees_fn, index_tree_1, no_prefixes=no_prefixes, sampling_rate=sampling_rate, autocomplete=autocomplete
+            )
+            _test_tree(index_tree_1)
+            _mark_complete(index_dir, 1)
+        else:
+            pro.message('[1/6] Tree already exists, skipping its creation', upper=True)
 
-    if not _is_complete(index_dir, 4):
-        recompute = True
+        #
+        # 2) Create and run Makefile for propagation, and merge FASTA files
+        #
 
-    if recompute:
-        pro.message('[4/6] Constructing OCC', upper=True)
-        _bwt2bwtocc(index_fa)
-        _mark_complete(index_dir, 4)
-    else:
-        pro.message('[4/6] OCC already exists, skipping their construction', upper=True)
+        if not _is_complete(index_dir, 2):
+            recompute = True
+
+        if recompute:
+            pro.message('[2/6] Running k-mer propagation', upper=True)
+            _create_makefile(index_dir, k, library_dir, mask_repeats=mask_repeats)
+            _propagate(index_dir, threads=threads)
+            _propagation_postprocessing(index_dir, index_tree_1, index_tree_2)
+            _test_tree(index_tree_2)
+            _kmer_stats(index_dir)
+            # the Makefile might be removed with the temporary files
+            _flush_file_md5()
+            if not keep_tmp_files:
+                _remove_tmp_propagation_files(index_dir)
+            else:
+                pro.message('Keeping temporary files')
+            _mark_complete(index_dir, 2)
+        else:
+            pro.message('[2/6] K-mers have already been propagated, skipping propagation', upper=True)
 
-    #
-    # 4) SA + 5) KLCP (compute SA + KLCP in parallel)
-    #
+        #
+        # 3) BWT
+        #
 
-    klcp_fn = "{}.{}.klcp".format(index_fa, k)
+        if not _is_complete(index_dir, 3) and not _is_complete(index_dir, 4, dont_check_previous=True):
+            recompute = True
+
+        if recompute:
+            pro.message('[3/6] Constructing BWT', upper=True)
+            pro.rm(index_fa + '.bwt', index_fa + '.bwt.complete')
+            _fa2pac(index_fa)
+            _pac2bwt(index_fa)
+            _mark_complete(index_dir, 3)
+        else:
+            pro.message('[3/6] BWT already exists, skipping its construction', upper=True)
 
-    if construct_klcp:
+        #
+        # 3) OCC
+        #
 
-        if not _is_complete(index_dir, 5):
-            # SA not computed yet => compute it in parallel with KLCP
+        if not _is_complete(index_dir, 4):
             recompute = True
 
         if recompute:
-            pro.message('[5/6],[6/6] Constructing SA + KLCP in parallel ', upper=True)
-            _bwtocc2sa_klcp(index_fa, k)
-            _mark_complete(index_dir, 5)
-            _mark_complete(index_dir, 6)
-            return
-
-    #
-    # 5) SA (compute only SA)
-    #
-
-    if not _is_complete(index_dir, 5):
-        recompute = True
-
-    if recompute:
-        pro.message('[5/6] Constructing SA', upper=True)
-        _bwtocc2sa(index_fa)
-    else:
-        pro.message('[5/6] SA already exists, skipping its construction', upper=True)
+            pro.message('[4/6] Constructing OCC', upper=True)
+            _bwt2bwtocc(index_fa)
+            _mark_complete(index_dir, 4)
+        else:
+            pro.message('[4/6] OCC already exists, skipping their construction', upper=True)
+
+        #
+        # 4) SA + 5) KLCP (compute SA + KLCP in parallel)
+        #
+
+        klcp_fn = "{}.{}.klcp".format(index_fa, k)
+
+        if construct_klcp:
+
+            if not _is_complete(index_dir, 5):
+                # SA not computed yet => compute it in parallel with KLCP
+                recompute = True
+
+            if recompute:
+                pro.message('[5/6],[6/6] Constructing SA + KLCP in parallel ', upper=True)
+                _bwtocc2sa_klcp(index_fa, k)
+                _mark_complete(index_dir, 5)
+                _mark_complete(index_dir, 6)
+                return
 
-    #
-    # 6) KLCP (compute only KLCP)
-    #
+        #
+        # 5) SA (compute only SA)
+        #
 
-    if construct_klcp:
-        if not _is_complete(index_dir, 6):
+        if not _is_complete(index_dir, 5):
             recompute = True
 
         if recompute:
-            pro.message('[6/6] Constructing k-LCP', upper=True)
-            _bwtocc2klcp(index_fa, k)
-            _mark_complete(index_dir, 6)
+            pro.message('[5/6] Constructing SA', upper=True)
+            _bwtocc2sa(index_fa)
         else:
-            pro.message('[6/6] k-LCP already exists, skipping its construction', upper=True)
+            pro.message('[5/6] SA already exists, skipping its construction', upper=True)
+
+        #
+        # 6) KLCP (compute only KLCP)
+        #
+
+        if construct_klcp:
+            if not _is_complete(index_dir, 6):
+                recompute = True
+
+            if recompute:
+                pro.message('[6/6] Constructing k-LCP', upper=True)
+                _bwtocc2klcp(index_fa, k)
+                _mark_complete(index_dir, 6)
+            else:
+                pro.message('[6/6] k-LCP already exists, skipping its construction', upper=True)
+    finally:
+        _flush_file_md5()
 
 
 #####################
@@ -812,8 +970,8 @@ def prophyle_index(
 
 
 def prophyle_classify(
-    index_dir, fq_fn, fq_pe_fn, k, out_format, mimic_kraken, measure, annotate, tie_lca, kmer_lca, print_seq, cimpl,
-    force_restarted_search, prophyle_conf_string
+    index_dir, fq_fn, fq_pe_fn, k, threads, out_format, mimic_kraken, measure, annotate, tie_lca, kmer_lca, print_seq,
+    cimpl, force_restarted_search, prophyle_conf_string
 ):
     """Run ProPhyle classification.
 
@@ -822,6 +980,7 @@ def prophyle_classify(
         fq_fn (str): Input reads (single-end or first of paired-end).
         fq_pe_fn (str): Input reads (second paired-end, None if single-end)
         k (int): K-mer size (None => detect automatically).
+        threads (int): Number of threads for k-mer matching.
         out_format (str): Output format: sam / kraken.
         mimic_kraken (bool): Mimic Kraken algorithm (compute LCA for each k-mer).
         measure (str): Measure used for classification (h1 / h2 / c1 / c2).
@@ -834,6 +993,9 @@ def prophyle_classify(
         prophyle_conf_string (str): ProPhyle configuration string.
     """
 
+    assert isinstance(threads, int)
+    assert threads > 0
+
     _compile_prophyle_bin(parallel=True)
     index_fa = os.path.join(index_dir, 'index.fa')
     index_tree = os.path.join(index_dir, 'tree.nw')
@@ -851,7 +1013,8 @@ def prophyle_classify(
 
     pro.test_files(IND)
 
-    pro.test_files(
+    # existence and sizes of the index files from a single stat call per file
+    (bwt_s, sa_s, _) = pro.test_files(
         index_fa + '.bwt',
         #index_fa + '.pac',
         index_fa + '.sa',
@@ -859,7 +1022,6 @@ def prophyle_classify(
         #index_fa + '.amb',
     )
 
-    (bwt_s, sa_s) = pro.file_sizes(index_fa + '.bwt', index_fa + '.sa')
     assert abs(bwt_s - 2 * sa_s) < 1000, 'Inconsistent index (SA vs. BWT)'
     #assert abs(bwt_s - 2 * pac_s) < 1000, 'Inconsistent index (PAC vs. BWT)'
 
@@ -868,11 +1030,14 @@ def prophyle_classify(
         pro.message("Restarted search forced")
         use_rolling_window = False
     else:
-        use_rolling_window = os.path.isfile(klcp_fn)
+        try:
+            klcp_st = os.stat(klcp_fn)
+        except OSError:
+            klcp_st = None
+        use_rolling_window = klcp_st is not None and stat.S_ISREG(klcp_st.st_mode)
         if use_rolling_window:
             pro.message("k-LCP file found, going to use rolling window")
-            pro.test_files(klcp_fn)
-            (klcp_s, ) = pro.file_sizes(klcp_fn)
+            klcp_s = klcp_st.st_size
             assert abs(bwt_s - 4 * klcp_s) < 1000, 'Inconsistent index (KLCP vs. BWT)'
         else:
             pro.message("k-LCP file not found, going to use restarted search")
@@ -914,8 +1079,10 @@ def prophyle_classify(
         # fq_fn can be '-' as well
         in_read = fq_fn
 
+    # the stages of the pipeline run concurrently, k-mer matching is the only multi-threaded one
     cmd_query = [
-        IND, 'query', '-k', k, '-u' if use_rolling_window else '', '-b' if print_seq else '', index_fa, in_read, '|'
+        IND, 'query', '-k', k, '-t', threads, '-u' if use_rolling_window else '', '-b' if print_seq else '', index_fa,
+        in_read, '|'
     ]
 
     command = cmd_read + cmd_query + cmd_assign
@@ -1242,6 +1409,15 @@ def parser():
         default=None,
     )
 
+    parser_classify.add_argument(
+        '-j',
+        metavar='INT',
+        dest='threads',
+        type=int,
+        help='number of threads for k-mer matching [auto ({})]'.format(DEFAULT_THREADS),
+        default=DEFAULT_THREADS,
+    )
+
     parser_classify.add_argument(
         '-k',
         dest='k',
@@ -1527,6 +1703,7 @@ def main():
                 fq_fn=args.reads,
                 fq_pe_fn=args.reads_pe,
                 k=args.k,
+                threads=args.threads,
                 out_format=args.oform,
                 mimic_kraken=args.mimic,
                 measure=args.measure,
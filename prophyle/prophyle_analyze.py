@@ -173,7 +173,8 @@ def load_asgs(in_fns, in_format):
 
             for read in read_iterator:
                 if in_format == 'kraken':
-                    res, read_name, read_ref = read.split('\t')[0:3]
+                    # only the first 3 columns are needed (the k-mer assignments are not split)
+                    res, read_name, read_ref = read.split('\t', 3)[0:3]
                     if res.strip() == 'U':
                         unclassified += 1
                         continue
@@ -181,13 +182,18 @@ def load_asgs(in_fns, in_format):
                     if read.is_unmapped:
                         unclassified += 1
                         continue
-                    read_name = read.qname
+                    read_name = read.query_name
                     read_ref = read.reference_name
+                read_name = read_name.strip()
+                read_ref = read_ref.strip()
                 try:
-                    if read_ref != 'merge_root':
-                        current_asgs[read_name.strip()].append(read_ref.strip())
+                    refs = current_asgs[read_name]
                 except KeyError:
-                    current_asgs[read_name.strip()] = [read_ref.strip()]
+                    current_asgs[read_name] = [read_ref]
+                else:
+                    # every (read, reference) pair is counted once, even if the records are repeated or not adjacent
+                    if read_ref != 'merge_root' and read_ref not in refs:
+                        refs.append(read_ref)
         finally:
             if base_fn != 'stdin':
                 f.close()
@@ -205,23 +211,35 @@ def asgs_to_leaves(tree, asgs):
     """
     asgs_to_leaves = {}
 
+    # node name => node (a single traversal instead of a tree search per assignment)
+    name_to_node = {}
+    for n in tree.traverse("preorder"):
+        name_to_node.setdefault(n.name, n)
+    # node name => names of descendant leaves (computed once per node)
+    name_to_leaves = {}
+
     for fn, asg_dict in asgs.items():
         asgs_to_leaves[fn] = {}
         for qname, ref in asg_dict.items():
             l = []
             for tax in ref:
-                if tax != "merge_root":
+                if tax == "merge_root":
+                    continue
+                try:
+                    leaves = name_to_leaves[tax]
+                except KeyError:
                     try:
-                        n = tree & tax
-                    except TreeError:
-                        print("[prophyle_analyze] Node {} not found in the tree".format(n1_name), file=sys.stderr)
-                        raise
-                if n.is_leaf():
-                    l.append(n.name)
-                else:
-                    for leaf in n:
-                        l.append(leaf.name)
-            asgs_to_leaves[fn][qname] = list(l)
+                        n = name_to_node[tax]
+                    except KeyError:
+                        print("[prophyle_analyze] Node {} not found in the tree".format(tax), file=sys.stderr)
+                        raise TreeError("No node found with name {}".format(tax))
+                    if n.is_leaf():
+                        leaves = [n.name]
+                    else:
+                        leaves = [leaf.name for leaf in n]
+                    name_to_leaves[tax] = leaves
+                l.extend(leaves)
+            asgs_to_leaves[fn][qname] = l
 
     return asgs_to_leaves
 
@@ -403,7 +403,14 @@ int32_t find_intersection(const std::vector<_set_T> &sets, _set_T &intersection)
 		3) Remove elements from intersection present in other sets.
 	*/
 
-	for(const _set_T &current_set : sets) {
+	for(int32_t i=0;i<static_cast<int32_t>(sets.size());i++){
+
+		/* the smallest set contains all its elements */
+		if(i==i_min){
+			continue;
+		}
+
+		const _set_T &current_set = sets[i];
 
 		for(auto it = intersection.begin(); it !=intersection.end();){
 
@@ -450,10 +457,15 @@ int assemble(const std::string &fasta_fn, _set_T &set, int32_t k, FILE* fstats,
 		file=fopen(fasta_fn.c_str(),"w+");
 		test_file(file, fasta_fn);
 	}
-	char kmer_str[max_allowed_kmer_length+1];
 	contig_t contig(k);
 	const std::vector<char> nucls = {'A','C','G','T'};
 
+	// masks for rolling encoding (a k-mer of size 32 fills the whole nkmer)
+	typedef typename _set_T::value_type _nkmer_T;
+	const int32_t last_nt_shift=2*(k-1);
+	const _nkmer_T kmer_mask=(2*k>=static_cast<int32_t>(8*sizeof(_nkmer_T))) ?
+		std::numeric_limits<_nkmer_T>::max() : ((static_cast<_nkmer_T>(1) << (2*k))-1);
+
 	//int32_t i=0;
 	int32_t contig_id=1;
 	while(set.size()>0){
@@ -465,7 +477,10 @@ int assemble(const std::string &fasta_fn, _set_T &set, int32_t k, FILE* fstats,
 		decode_kmer(central_nkmer,k,central_kmer_string);
 		contig.new_contig(central_kmer_string.c_str());
 
-		typename _set_T::value_type nkmer;
+		_nkmer_T nkmer;
+		// forward and reverse-complement encodings of the last k-mer of the extended end
+		_nkmer_T nkmer_f;
+		_nkmer_T nkmer_r;
 
 
 		for (int direction=0;direction<2;direction++){
@@ -480,8 +495,8 @@ int assemble(const std::string &fasta_fn, _set_T &set, int32_t k, FILE* fstats,
 				reverse_complement_in_place(central_kmer_string);
 			}
 
-			strncpy(kmer_str,central_kmer_string.c_str(),k);
-			kmer_str[k]='\0';
+			encode_forward(central_kmer_string.c_str(), k, nkmer_f);
+			encode_reverse(central_kmer_string.c_str(), k, nkmer_r);
 
 			bool extending = true;
 
@@ -489,18 +504,18 @@ int assemble(const std::string &fasta_fn, _set_T &set, int32_t k, FILE* fstats,
 
 
 			while (extending){
-				for(int32_t i=0;i<k;i++){
-					kmer_str[i]=kmer_str[i+1];
-				}
-				kmer_str[k]='\0';
-
 				extending=false;
 				for(const char &c : nucls){
-					kmer_str[k-1]=c;
+					// rolling encoding of the successor (no re-encoding of the whole k-mer)
+					const _nkmer_T nt4=nt256_nt4[static_cast<int32_t>(c)];
+					const _nkmer_T succ_f=((nkmer_f << 2) | nt4) & kmer_mask;
+					const _nkmer_T succ_r=(nkmer_r >> 2) | ((3-nt4) << last_nt_shift);
 
-					encode_canonical(kmer_str, k, nkmer);
+					nkmer=std::min(succ_f,succ_r);
 
 					if(set.count( nkmer )){
+						nkmer_f=succ_f;
+						nkmer_r=succ_r;
 						//std::cerr << "extending " << c << std::endl;
 						//debug_print_kmer_set(set,k);
 						//std::cerr << std::string(contig.l_ext) << c << std::endl;
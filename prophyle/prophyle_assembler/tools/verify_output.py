@@ -8,7 +8,6 @@ Licence: MIT
 
 import sys
 import re
-from Bio import SeqIO
 
 in1_fn = sys.argv[1]
 in2_fn = sys.argv[2]
@@ -19,32 +18,51 @@ k = int(sys.argv[6])
 
 reg_splitting = re.compile("[^ACGT]")
 
-comp_dict = {
-    "A": "T",
-    "C": "G",
-    "G": "C",
-    "T": "A",
-}
+# translation table (str.translate runs in C, no per-character dict lookups)
+comp_table = str.maketrans("ACGT", "TGCA")
 
 
 def reverse_complement_str(dna):
-    reverse_complement = "".join([comp_dict[x] for x in dna[::-1]])
+    reverse_complement = dna[::-1].translate(comp_table)
     return reverse_complement
 
 
+def iter_fasta(fasta_fn):
+    """Iterate over (name, sequence) pairs of a FASTA file (streamed, without Biopython records)."""
+    name = None
+    seq = []
+    with open(fasta_fn) as f:
+        for x in f:
+            x = x.strip()
+            if x == "":
+                continue
+            if x[0] == ">":
+                if name is not None:
+                    yield name, "".join(seq)
+                    seq = []
+                parts = x[1:].split(maxsplit=1)
+                name = parts[0] if parts else ""
+            else:
+                seq.append(x)
+    if name is not None:
+        yield name, "".join(seq)
+
+
 def get_canonical_kmers_from_fasta(fasta_fn, k):
     kmers = set()
 
     reg_splitting = re.compile("[^ACGT]")
     set_of_kmers = set()
-    fasta_sequences = SeqIO.parse(fasta_fn, 'fasta')
-    for fasta_seq in fasta_sequences:
-        name, sequence = fasta_seq.id, str(fasta_seq.seq).upper()
+    for name, sequence in iter_fasta(fasta_fn):
+        sequence = sequence.upper()
         sequences_ok = reg_splitting.split(sequence)
         for seq in sequences_ok:
-            for i in range(len(seq) - k + 1):
+            # the reverse complement is computed once per sequence, not per k-mer
+            seq_rc = reverse_complement_str(seq)
+            n = len(seq)
+            for i in range(n - k + 1):
                 kmer = seq[i:i + k]
-                kmer_rc = reverse_complement_str(kmer)
+                kmer_rc = seq_rc[n - i - k:n - i]
                 set_of_kmers.add(min(kmer, kmer_rc))
     return set_of_kmers
 
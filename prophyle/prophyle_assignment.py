@@ -15,7 +15,6 @@ import argparse
 #import bitarray
 import collections
 import functools
-import itertools
 import os
 import sys
 
@@ -40,6 +39,16 @@ CONFIG = {
 
 from bitarray import bitarray as _bitarray
 
+# SAM tags with the values of the measures (tag, tag prefix)
+SAM_TAG_PREFIXES = [
+    ('h1', 'h1:i:'),
+    ('h2', 'h2:f:'),
+    ('hf', 'hf:f:'),
+    ('c1', 'c1:i:'),
+    ('c2', 'c2:f:'),
+    ('cf', 'cf:f:'),
+]
+
 
 class bitarray(_bitarray):
     def __hash__(self):
@@ -101,6 +110,16 @@ class Assignment:
         if CONFIG['DIAGNOSTICS']:
             self.krakline_parser.diagnostics()
 
+        # unassigned read (only 0/A blocks) => no masks and no assignments to compute
+        if not self.krakline_parser.has_hits:
+            self.hitmasks_dict = {}
+            self.covmasks_dict = {}
+            self.ass_dict = {}
+            self.max_nodenames = []
+            self.max_val = 0
+            self.print_selected_assignments(form)
+            return
+
         self.blocks_to_masks(self.krakline_parser.kmer_blocks, self.kmer_lca)
         if CONFIG['DIAGNOSTICS']:
             self.diagnostics()
@@ -143,15 +162,13 @@ class Assignment:
             # Kraken output format: 0 and A have special meanings, no blocks
             if node_names != ["0"] and node_names != ["A"]:
 
-                hitmask_1block = self.bitarray_block(hitmask_len, count, pos)
-                covmask_1block = self.bitarray_block(covmask_len, count + self.k - 1, pos)
-
                 if kmer_lca:
                     node_names = [self.tree_index.lca(*node_names)]
 
+                # OR with a block of ones == setting a slice (no temporary bitarrays)
                 for node_name in node_names:
-                    hitmasks_dict[node_name] |= hitmask_1block
-                    covmasks_dict[node_name] |= covmask_1block
+                    hitmasks_dict[node_name][pos:pos + count] = True
+                    covmasks_dict[node_name][pos:pos + count + self.k - 1] = True
 
             pos += count
 
@@ -159,47 +176,68 @@ class Assignment:
         self.covmasks_dict = covmasks_dict
 
     def compute_assignments(self):
-        """Compute assignments & characteristics.
+        """Compute assignments.
 
-        Compute and their characteristics from hitmasks and store
-        them in self.ass_dict.
+        Propagate masks and store them in self.ass_dict. The characteristics are
+        computed later, only for the winners (see select_best_assignments).
         """
 
-        nodenames = self.hitmasks_dict.keys()
-        self.ass_dict = {nodename: self.evaluate_single_assignment(nodename) for nodename in nodenames}
+        nodename_to_upnodename = self.tree_index.nodename_to_upnodename
+        nodename_to_depth = self.tree_index.nodename_to_depth
+
+        ass_dict = {}
+
+        # top-down propagation: ancestors are processed before their descendants and every node
+        # takes the (already propagated) masks of its closest hit ancestor => a single OR per node
+        for nodename in sorted(self.hitmasks_dict.keys(), key=lambda x: nodename_to_depth[x]):
 
-    def evaluate_single_assignment(self, nodename):
+            #################################
+            # A) Start with the current masks
+            #################################
+            # (not copied: the masks are never modified in place, see B)
+            hitmask = self.hitmasks_dict[nodename]
+            covmask = self.covmasks_dict[nodename]
+
+            ##########################################
+            # B) Update from the closest hit ancestor
+            ##########################################
+            anc_nodename = nodename_to_upnodename[nodename]
+            while anc_nodename is not None and anc_nodename not in self.hitmasks_dict:
+                anc_nodename = nodename_to_upnodename[anc_nodename]
+            if anc_nodename is not None:
+                # a single new bitarray per mask (instead of a copy followed by an in-place OR)
+                hitmask = hitmask | ass_dict[anc_nodename]['hitmask']
+                covmask = covmask | ass_dict[anc_nodename]['covmask']
+
+            ass_dict[nodename] = {'hitmask': hitmask, 'covmask': covmask}
+
+        # keep the original order of nodes (order of reported ties)
+        self.ass_dict = {nodename: ass_dict[nodename] for nodename in self.hitmasks_dict}
+
+    def evaluate_single_assignment(self, nodename, hitmask, covmask, hit=None, cov=None):
         """Evaluate a single assignment.
 
         Args:
             nodename (str): Name of the node for which we will compute characteristics.
+            hitmask (bitarray): Hit mask propagated from the ancestors.
+            covmask (bitarray): Coverage mask propagated from the ancestors.
+            hit (int): Number of ones in hitmask if already known (None => computed).
+            cov (int): Number of ones in covmask if already known (None => computed).
 
         Returns:
             assignment (dict): Assignment dictionary.
         """
 
-        #################################
-        # A) Start with the current masks
-        #################################
-        hitmask = bitarray(self.hitmasks_dict[nodename])
-        covmask = bitarray(self.covmasks_dict[nodename])
-
-        node = self.tree_index.nodename_to_node[nodename]
-
-        ##########################
-        # B) Update from ancestors
-        ##########################
-        ancestors = self.tree_index.nodename_to_upnodenames[nodename] & self.hitmasks_dict.keys()
-        for anc_nodename in ancestors:
-            hitmask |= self.hitmasks_dict[anc_nodename]
-            covmask |= self.covmasks_dict[anc_nodename]
-
         ##############################
-        # C) Calculate characteristics
+        # Calculate characteristics
         ##############################
-        hit = hitmask.count()
-        cov = covmask.count()
+        if hit is None:
+            hit = hitmask.count()
+        if cov is None:
+            cov = covmask.count()
         readlen = self.krakline_parser.readlen
+        # nodes without any k-mer (e.g., k-mer LCA nodes) get zero normalized scores
+        kmercount = self.tree_index.nodename_to_kmercount[nodename]
 
         assignment = {
             # 1. hit count
@@ -207,14 +245,14 @@ class Assignment:
             #'hitcigar': self.cigar_from_bitmask(hitmask),
             'h1': [hit],
             'hf': [hit / (readlen - self.k + 1)],
-            'h2': [hit / self.tree_index.nodename_to_kmercount[nodename]],
+            'h2': [hit / kmercount if kmercount else 0.0],
 
             # 2. coverage
             'covmask': covmask,
             #'covcigar': self.cigar_from_bitmask(covmask),
             'c1': [cov],
             'cf': [cov / readlen],
-            'c2': [cov / self.tree_index.nodename_to_kmercount[nodename]],
+            'c2': [cov / kmercount if kmercount else 0.0],
 
             # 3. other values
             'ln': readlen,
@@ -229,21 +267,45 @@ class Assignment:
             measure (str): Measure (h1/c1/h2/c2).
         """
 
-        self.max_val = 0
-        self.max_nodenames = []
+        max_val = 0
+        max_nodenames = []
 
-        for nodename in self.ass_dict:
-            ass = self.ass_dict[nodename]
+        # only the selected measure is computed for every node
+        if measure in ("h1", "h2"):
+            mask_key, count_key = 'hitmask', 'hit'
+        else:
+            mask_key, count_key = 'covmask', 'cov'
+        normalize = measure in ("h2", "c2")
+        nodename_to_kmercount = self.tree_index.nodename_to_kmercount
 
-            if ass[measure][0] > self.max_val:
-                self.max_val = ass[measure][0]
-                self.max_nodenames = [nodename]
+        # popcounts are kept to be reused for the winners
+        popcounts = {}
 
-            elif ass[measure][0] == self.max_val:
-                self.max_nodenames.append(nodename)
+        for nodename, ass in self.ass_dict.items():
+            val = popcounts[nodename] = ass[mask_key].count()
+            if normalize:
+                kmercount = nodename_to_kmercount[nodename]
+                val = val / kmercount if kmercount else 0.0
+
+            if val > max_val:
+                max_val = val
+                max_nodenames = [nodename]
+
+            elif val == max_val:
+                max_nodenames.append(nodename)
+
+        # all characteristics are computed only for the winners
+        for nodename in max_nodenames:
+            ass = self.ass_dict[nodename]
+            self.ass_dict[nodename] = self.evaluate_single_assignment(
+                nodename, ass['hitmask'], ass['covmask'], **{count_key: popcounts[nodename]}
+            )
 
         if CONFIG['SORT_NODES']:
-            self.max_nodenames.sort()
+            max_nodenames.sort()
+
+        self.max_val = max_val
+        self.max_nodenames = max_nodenames
 
     def make_lca_from_winners(self):
         """Create LCA from winners.
@@ -318,11 +380,18 @@ class Assignment:
         """
 
         c = []
-        bitmask = map(bool, bitmask)
-        runs = itertools.groupby(bitmask)
-        for run in runs:
-            c.append(str(len(list(run[1]))))
-            c.append('=' if run[0] else 'X')
+        n = len(bitmask)
+        i = 0
+        # jump over runs using bitarray's search (implemented in C), not bit by bit
+        while i < n:
+            bit = bool(bitmask[i])
+            try:
+                j = bitmask.index(not bit, i)
+            except ValueError:
+                j = n
+            c.append(str(j - i))
+            c.append('=' if bit else 'X')
+            i = j
         return "".join(c)
 
     def print_sam_line(self, node_name, suffix):
@@ -365,21 +434,15 @@ class Assignment:
         if node_name is not None:
             asg = self.ass_dict[node_name]
 
-            for tag, datatype in [
-                ('h1', 'i'),
-                ('h2', 'f'),
-                ('hf', 'f'),
-                ('c1', 'i'),
-                ('c2', 'f'),
-                ('cf', 'f'),
-            ]:
+            for tag, prefix in SAM_TAG_PREFIXES:
                 for val in asg[tag]:
-                    columns.append("{}:{}:{}".format(tag, datatype, val))
+                    columns.append(prefix + str(val))
 
             if asg['hitcigar']:
-                columns.append("hc:Z:{}".format(asg['hitcigar']))
+                columns.append("hc:Z:" + asg['hitcigar'])
 
-        print("\t".join(columns), suffix, file=self.output_fo, sep="")
+        # a single write call per record
+        self.output_fo.write("\t".join(columns) + suffix + "\n")
 
     def print_sam_header(self):
         """Print SAM headers.
@@ -430,8 +493,13 @@ class Assignment:
 
         # recompute krakenmers
         if self.kmer_lca:
-            nodenames_lca_seq = []
+            # blocks are already run-length encoded, only adjacent blocks with the same LCA are merged
+            c = []
+            run_nodename = None
+            run_count = 0
             for [nodenames, count] in self.krakline_parser.kmer_blocks:
+                if count == 0:
+                    continue
                 if len(nodenames) == 1:
                     nodename = nodenames[0]
                     #if nodename == "A" or nodename == "0":
@@ -440,17 +508,21 @@ class Assignment:
                     #    pass
                 else:
                     nodename = self.tree_index.lca(*nodenames)
-                nodenames_lca_seq.extend(count * [nodename])
-            c = []
-            runs = itertools.groupby(nodenames_lca_seq)
-            for run in runs:
-                c.append("{}:{}".format(str(run[0]), len(list(run[1]))))
+                if nodename == run_nodename:
+                    run_count += count
+                else:
+                    if run_count > 0:
+                        c.append("{}:{}".format(run_nodename, run_count))
+                    run_nodename = nodename
+                    run_count = count
+            if run_count > 0:
+                c.append("{}:{}".format(run_nodename, run_count))
             krakmers = " ".join(c)
         else:
             krakmers = self.krakline_parser.krakmers
 
         columns = [stat, self.krakline_parser.readname, krak_ass, str(self.krakline_parser.readlen), krakmers]
-        print("\t".join(columns), file=self.output_fo)
+        self.output_fo.write("\t".join(columns) + "\n")
 
     @staticmethod
     def bitarray_block(alen, blen, pos):
@@ -464,7 +536,10 @@ class Assignment:
         Return:
             bitarray (bitarray)
         """
-        return bitarray(pos * "0" + blen * "1" + (alen - pos - blen) * "0")
+        a = bitarray(alen)
+        a.setall(False)
+        a[pos:pos + blen] = True
+        return a
 
     def diagnostics(self):
         """Print debug messages.
@@ -495,7 +570,8 @@ class TreeIndex:
         k (int): K-mer size.
         nodename_to_node (dict): node name => node.
         nodename_to_samannot (dict): node name => string to append in SAM.
-        nodename_to_upnodenames (dict): node name => set of node names of ancestors.
+        nodename_to_upnodename (dict): node name => node name of the parent (None for the root).
+        nodename_to_depth (dict): node name => depth of the node.
         nodename_to_kmercount (dict): nname => number of k-mers (full set).
     """
 
@@ -510,40 +586,40 @@ class TreeIndex:
 
         self.nodename_to_samannot = {}
 
-        self.nodename_to_upnodenames = collections.defaultdict(lambda: set())
+        self.nodename_to_upnodename = {}
+        self.nodename_to_depth = {}
 
-        for node in self.tree.traverse("postorder"):
+        # a single preorder traversal (parents before children => depths can be computed on the fly)
+        for node in self.tree.traverse("preorder"):
             nodename = node.name
             self.nodename_to_node[nodename] = node
             self.nodename_to_kmercount[nodename] = int(node.kmers_full)
 
-            # annotations
+            # annotations (getattr with a default instead of catching AttributeError for every node)
             tags_parts = []
-            try:
-                tags_parts.append("gi:Z:{}".format(node.gi))
-            except AttributeError:
-                pass
-
-            try:
-                tags_parts.append("sn:Z:{}".format(node.sci_name))
-            except AttributeError:
-                pass
-
-            try:
-                tags_parts.append("ra:Z:{}".format(node.rank))
-            except AttributeError:
-                pass
+            for tag, feature in (("gi", "gi"), ("sn", "sci_name"), ("ra", "rank")):
+                value = getattr(node, feature, None)
+                if value is not None:
+                    tags_parts.append("{}:Z:{}".format(tag, value))
 
             self.nodename_to_samannot[nodename] = "\t".join(tags_parts)
 
-            # set of upper nodes
-            while node.up:
-                node = node.up
-                self.nodename_to_upnodenames[nodename].add(node.name)
+            # parent & depth
+            if node.up:
+                upnodename = node.up.name
+                self.nodename_to_upnodename[nodename] = upnodename
+                self.nodename_to_depth[nodename] = self.nodename_to_depth[upnodename] + 1
+            else:
+                self.nodename_to_upnodename[nodename] = None
+                self.nodename_to_depth[nodename] = 0
 
+    @functools.lru_cache(maxsize=65536)
     def lca(self, *node_names):
         """Return LCA for a given list of nodes.
 
+        The same node lists repeat across k-mer blocks and reads (and with
+        k-mer LCA, every block is resolved twice), therefore results are cached.
+
         *node_names (list of str): List of node names.
 
         Returns:
@@ -552,9 +628,26 @@ class TreeIndex:
         assert len(node_names) > 0
         if len(node_names) == 1:
             return node_names[0]
-        nodes = list(map(lambda x: self.nodename_to_node[x], node_names))
-        lca = nodes[0].get_common_ancestor(nodes)
 
+        # climbing using parents and depths (without ete3 ancestor lists)
+        up = self.nodename_to_upnodename
+        depth = self.nodename_to_depth
+
+        lca_name = node_names[0]
+        for node_name in node_names[1:]:
+            d1 = depth[lca_name]
+            d2 = depth[node_name]
+            while d1 > d2:
+                lca_name = up[lca_name]
+                d1 -= 1
+            while d2 > d1:
+                node_name = up[node_name]
+                d2 -= 1
+            while lca_name != node_name:
+                lca_name = up[lca_name]
+                node_name = up[node_name]
+
+        lca = self.nodename_to_node[lca_name]
         if lca.is_root() and len(lca.children) == 1:
             lca = lca.children[0]
         assert lca.name != ""  #, [x.name for x in lca.children]
@@ -570,7 +663,8 @@ class TreeIndex:
         print("TreeIndex.k:                       ", self.k, file=sys.stderr)
         print("TreeIndex.nodename_to_node:        ", self.nodename_to_node, file=sys.stderr)
         print("TreeIndex.nodename_to_samannot:    ", self.nodename_to_samannot, file=sys.stderr)
-        print("TreeIndex.nodename_to_upnodenames: ", self.nodename_to_upnodenames, file=sys.stderr)
+        print("TreeIndex.nodename_to_upnodename:  ", self.nodename_to_upnodename, file=sys.stderr)
+        print("TreeIndex.nodename_to_depth:       ", self.nodename_to_depth, file=sys.stderr)
         print("TreeIndex.nodename_to_kmercount:   ", self.nodename_to_kmercount, file=sys.stderr)
 
 
@@ -588,6 +682,7 @@ class KraklineParser():
         seq (str): Sequence of nucleotides. None if unknown.
         qual (str): Sequence of qualities. None if unknown.
         kmer_blocks (list of (list of str, int)): Assigned k-mer blocks, list of (nodenames, count).
+        has_hits (bool): At least one k-mer block is assigned to a node (i.e., not only 0/A blocks).
     """
 
     def __init__(self):
@@ -597,6 +692,7 @@ class KraklineParser():
         self.seq = None
         self.qual = None
         self.kmer_blocks = []
+        self.has_hits = False
 
     def parse_krakline(self, krakline):
         """Load a krakline to the current object.
@@ -617,13 +713,25 @@ class KraklineParser():
             self.qual = None
 
         # list of (count,list of nodes)
-        self.kmer_blocks = []
+        self.kmer_blocks = [self.parse_kmer_block(block) for block in self.krakmers.split(" ")]
+        self.has_hits = any(nodenames != ["0"] and nodenames != ["A"] for (nodenames, _) in self.kmer_blocks)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=65536)
+    def parse_kmer_block(block):
+        """Parse a single k-mer block of a krakline.
 
-        for block in self.krakmers.split(" "):
-            (ids, count) = block.split(":")
-            count = int(count)
-            nodenames = ids.split(",")
-            self.kmer_blocks.append((nodenames, count))
+        The same blocks repeat across reads, therefore parsed blocks are cached
+        (the returned structures are shared and must not be modified).
+
+        Args:
+            block (str): K-mer block (e.g., "1,2:5").
+
+        Returns:
+            (list of str, int): Node names and count.
+        """
+        (ids, count) = block.split(":")
+        return (ids.split(","), int(count))
 
     def check_consistency(self, k):
         """Check consistency of the fields loaded from the krakline.
@@ -663,6 +771,7 @@ class KraklineParser():
         print("KraklineParser.seq:         ", self.seq, file=sys.stderr)
         print("KraklineParser.qual:        ", self.qual, file=sys.stderr)
         print("KraklineParser.kmer_blocks: ", self.kmer_blocks, file=sys.stderr)
+        print("KraklineParser.has_hits:    ", self.has_hits, file=sys.stderr)
 
 
 ###############################################################################################
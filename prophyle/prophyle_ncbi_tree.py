@@ -13,8 +13,6 @@ TODO(Karel):
     * unify cli interface with the main prophyle program (parameters, etc.)
 """
 
-# ! /usr/bin/env python3
-
 import sys
 import os
 import argparse
@@ -36,22 +34,25 @@ def acquire_sequences(library, library_dir, log):
         for filename in (f for f in filenames if f.endswith('.fai')):
             fn = os.path.join(dirpath, filename)
             rel_fn = fn[(len(library_dir) + 1):-4]
+            # RefSeq filenames start with accession numbers (computed once per file, not per sequence)
+            f = (filename.split('.')[0]).split('_')
+            acc = f[0].strip() + '_' + f[1].strip() if len(f) > 1 else None
             with open(fn, 'r') as faidx:
                 for seq in faidx:
                     try:
                         seqname, seqlen, offset, _, _ = seq.split('\t')
-                        # RefSeq filenames start with accession numbers
-                        f = (filename.split('.')[0]).split('_')
-                        acc = f[0].strip() + '_' + f[1].strip()
+                        if acc is None:
+                            raise ValueError('No accession number in the file name')
+                        # one list per field, joined by '@' only when the tree is built
                         try:
-                            seqs[acc]['fn'] += '@' + rel_fn
-                            seqs[acc]['seqname'] += '@' + seqname
-                            seqs[acc]['seqlen'] += '@' + seqlen
-                            seqs[acc]['offset'] += '@' + offset
+                            s = seqs[acc]
                         except KeyError:
-                            seqs[acc] = {'fn': rel_fn, 'seqname': seqname, 'seqlen': seqlen, 'offset': offset}
+                            s = seqs[acc] = {'fn': [], 'seqname': [], 'seqlen': [], 'offset': []}
                             acquired += 1
-                            pass
+                        s['fn'].append(rel_fn)
+                        s['seqname'].append(seqname)
+                        s['seqlen'].append(seqlen)
+                        s['offset'].append(offset)
                     except:
                         if log:
                             print(
@@ -72,6 +73,9 @@ def assign_sequences(taxid_map_f, seqs, log):
     with open(taxid_map_f, 'r') as taxid_map:
         for line in taxid_map:
             acc, taxid = line.split('\t')
+            # the map can cover the whole NCBI, keep only the accessions from the library
+            if acc not in seqs:
+                continue
             taxid = int(taxid)
             try:
                 taxa2acc[taxid].append(acc)
@@ -98,16 +102,18 @@ def build_tree(seqs, taxa2acc, red_factor, root, log):
     # Important: you should update ETE DB before running this script.
     # This is done automatically only if it has not been downloaded yet.
     ncbi = NCBITaxa()
-    taxa = []
+    # a set: taxids shared by several sequences are queried once and
+    # a taxid missing in the DB is removed in O(1) (no list shifting)
+    taxa = set()
     for s in seqs.values():
         try:
-            taxa.append(s['taxid'])
+            taxa.add(s['taxid'])
         except KeyError:
             continue
     built = False
     while not built:
         try:
-            t = ncbi.get_topology(taxa, intermediate_nodes=True)
+            t = ncbi.get_topology(list(taxa), intermediate_nodes=True)
             built = True
         except KeyError as e:
             taxid_not_found = int(e.args[0])
@@ -124,7 +130,7 @@ def build_tree(seqs, taxa2acc, red_factor, root, log):
         internal_with_fasta = 0
         for node in t.traverse('postorder'):
             if not node.is_leaf() and node.taxid in taxa:
-                internal_with_fasta += len([acc for acc in taxa2acc[node.taxid] if acc in seqs.keys()])
+                internal_with_fasta += len([acc for acc in taxa2acc[node.taxid] if acc in seqs])
         print(
             '[prophyle_ncbi_tree] ' + str(internal_with_fasta) + ' sequences' +
             ' ignored because associated to internal node (see issue #153)', file=log
@@ -148,33 +154,34 @@ def build_tree(seqs, taxa2acc, red_factor, root, log):
                 taxa_to_keep.append(leaf.taxid)
         t = ncbi.get_topology(taxa_to_keep, intermediate_nodes=True)
 
-    node_count = len(t.get_descendants()) + 1
+    # nodes are counted during the annotation traversal (no extra get_descendants() pass)
+    node_count = 0
     seq_count = 0
 
     for node in t.traverse('postorder'):
+        node_count += 1
         node.name = node.taxid
         if node.is_leaf():
-            first = True
+            # collect the parts first and join them at the end (no quadratic string concatenation)
+            accession = []
+            fastapath = []
+            base_len = []
+            infasta_offset = []
             for acc in taxa2acc[node.taxid]:
                 try:
                     s = seqs[acc]
-                    if first:
-                        accession = '@'.join([acc] * (s['offset'].count('@') + 1))
-                        fastapath = s['fn']
-                        base_len = s['seqlen']
-                        infasta_offset = s['offset']
-                        first = False
-                    else:
-                        accession += ('@' + acc) * (s['offset'].count('@') + 1)
-                        fastapath += '@' + s['fn']
-                        base_len += '@' + s['seqlen']
-                        infasta_offset += '@' + s['offset']
-                    seq_count += 1
                 except KeyError:
-                    pass
-            node.add_features(
-                fastapath=fastapath, base_len=base_len, infasta_offset=infasta_offset, accession=accession
-            )
+                    continue
+                accession.extend([acc] * len(s['offset']))
+                fastapath.extend(s['fn'])
+                base_len.extend(s['seqlen'])
+                infasta_offset.extend(s['offset'])
+                seq_count += 1
+            if fastapath:
+                node.add_features(
+                    fastapath='@'.join(fastapath), base_len='@'.join(base_len),
+                    infasta_offset='@'.join(infasta_offset), accession='@'.join(accession)
+                )
 
     if not hasattr(t, 'taxid'):
         t.add_features(taxid=0)
@@ -78,11 +78,12 @@ def build_complete_tree(tree, log):
     """
     ncbi = NCBITaxa()
     original_tree = Tree(tree, format=1)
-    taxa = [n.taxid for n in original_tree.traverse('postorder')]
+    # unique taxids (nodes can share a taxid)
+    taxa = set(n.taxid for n in original_tree.traverse('postorder'))
     built = False
     while not built:
         try:
-            complete_tree = ncbi.get_topology(taxa, intermediate_nodes=True)
+            complete_tree = ncbi.get_topology(list(taxa), intermediate_nodes=True)
             built = True
         except KeyError as e:
             # if a taxid is not found, try to build the tree without it
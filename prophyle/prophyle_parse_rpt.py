@@ -1,6 +1,7 @@
 #! /usr/bin/env python3
 
 import os
+import sys
 import argparse
 
 if __name__ == '__main__':
@@ -19,4 +20,5 @@ if __name__ == '__main__':
                         acc = (line.split(':')[1]).split('.')[0].strip()
                     elif line.startswith('Taxid:'):
                         tax = line.split(':')[1].strip()
-                        print(acc, tax, sep='\t')
+                        # a single write per record (print issues one per field and separator)
+                        sys.stdout.write("{}\t{}\n".format(acc, tax))
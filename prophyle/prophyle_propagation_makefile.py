@@ -63,6 +63,67 @@ def tree_size(tree):
     return (nodes, leaves)
 
 
+# Makefile templates (dedented once at import, not for every node)
+
+MERGE_HEADER_TPL = textwrap.dedent(
+    """\
+    #
+    # Merging FASTA files: {output_file}
+    #
+    """
+)
+
+MERGE_LEAF_TPL = textwrap.dedent(
+    """\
+
+        {ocompl}: {i}
+        \tcat $^ $(CMD_MASKING) $(CMD_REASM) > {o}
+        \t@touch $@
+
+    """
+)
+
+MERGE_INTERNAL_TPL = textwrap.dedent(
+    """\
+
+        {ocompl}: {icompl} {nhx}
+        \tcat {i} > {o}
+        \t@touch $@
+
+    """
+)
+
+ASSEMBLY_HEADER_TPL = textwrap.dedent(
+    """\
+    #
+    # Assemblying FASTA files: {intersection_file}
+    #
+    """
+)
+
+ASSEMBLY_TPL = textwrap.dedent(
+    """\
+        ifdef NONDEL
+           CMD_ASM_OUT_{nid} =
+        else
+           CMD_ASM_OUT_{nid} = -o {oo}
+        endif
+
+        ifdef NONPROP
+           CMD_ASM_{nid} = @touch {x} {o}
+        else
+           CMD_ASM_{nid} = $(PRG_ASM) -S -k $(K) -x {x} -i {ii} $(CMD_ASM_OUT_{nid}) -s {c}
+        endif
+
+        {xcompl}: {icompl} {nhx}
+        \t@echo starting propagation for $@
+        \t$(CMD_ASM_{nid})
+        \t@touch $@
+        \t-$(PRINT_PROGRESS)
+        """
+)
+
+
 def merge_fasta_files(input_files_fn, output_file_fn, is_leaf, makefile_fo, nhx_file_fn=None):
     """Print Makefile lines for merging FASTA files and removing empty lines.
 
@@ -75,46 +136,21 @@ def merge_fasta_files(input_files_fn, output_file_fn, is_leaf, makefile_fo, nhx_
     """
 
     if is_leaf:
-        cmd = textwrap.dedent(
-            """\
-
-                {ocompl}: {i}
-                \tcat $^ $(CMD_MASKING) $(CMD_REASM) > {o}
-                \t@touch $@
-
-            """.format(
-                i=' '.join(input_files_fn),
-                o=output_file_fn,
-                ocompl=_compl(output_file_fn),
-            )
+        cmd = MERGE_LEAF_TPL.format(
+            i=' '.join(input_files_fn),
+            o=output_file_fn,
+            ocompl=_compl(output_file_fn),
         )
     else:
-
-        cmd = textwrap.dedent(
-            """\
-
-                {ocompl}: {icompl} {nhx}
-                \tcat {i} > {o}
-                \t@touch $@
-
-            """.format(
-                i=' '.join(input_files_fn),
-                icomp=' '.join(_compl_l(input_files_fn)),
-                o=output_file_fn,
-                ocomp=_compl(output_file_fn),
-                nhx=nhx_file_fn if nhx_file_fn is not None else "",
-            )
+        cmd = MERGE_INTERNAL_TPL.format(
+            i=' '.join(input_files_fn),
+            icompl=' '.join(_compl_l(input_files_fn)),
+            o=output_file_fn,
+            ocompl=_compl(output_file_fn),
+            nhx=nhx_file_fn if nhx_file_fn is not None else "",
         )
 
-    print(
-        textwrap.dedent(
-            """\
-            #
-            # Merging FASTA files: {output_file}
-            #
-            """.format(output_file=output_file_fn)
-        ) + cmd, file=makefile_fo
-    )
+    makefile_fo.write(MERGE_HEADER_TPL.format(output_file=output_file_fn) + cmd + "\n")
 
 
 def assembly(
@@ -134,48 +170,19 @@ def assembly(
     assert len(input_files_fn) == len(output_files_fn)
     # assert intersection_file not in input_files
     # print(intersection_file, input_files,file=sys.stderr)
-    cmd = textwrap.dedent(
-        """\
-            ifdef NONDEL
-               CMD_ASM_OUT_{nid} =
-            else
-               CMD_ASM_OUT_{nid} = -o {oo}
-            endif
-
-            ifdef NONPROP
-               CMD_ASM_{nid} = @touch {x} {o}
-            else
-               CMD_ASM_{nid} = $(PRG_ASM) -S -k $(K) -x {x} -i {ii} $(CMD_ASM_OUT_{nid}) -s {c}
-            endif
-
-            {xcompl}: {icompl} {nhx}
-            \t@echo starting propagation for $@
-            \t$(CMD_ASM_{nid})
-            \t@touch $@
-            \t-$(PRINT_PROGRESS)
-            """.format(
-            icompl=' '.join(_compl_l(input_files_fn)),
-            o=' '.join(output_files_fn),
-            ii=' -i '.join(input_files_fn),
-            oo=' -o '.join(output_files_fn),
-            x=intersection_file_fn,
-            xcompl=_compl(intersection_file_fn),
-            c=counts_fn,
-            nid=intersection_file_fn,
-            nhx=nhx_file_fn if nhx_file_fn is not None else "",
-        )
+    cmd = ASSEMBLY_TPL.format(
+        icompl=' '.join(_compl_l(input_files_fn)),
+        o=' '.join(output_files_fn),
+        ii=' -i '.join(input_files_fn),
+        oo=' -o '.join(output_files_fn),
+        x=intersection_file_fn,
+        xcompl=_compl(intersection_file_fn),
+        c=counts_fn,
+        nid=intersection_file_fn,
+        nhx=nhx_file_fn if nhx_file_fn is not None else "",
     )
 
-    print(
-        textwrap.dedent(
-            """\
-            #
-            # Assemblying FASTA files: {intersection_file}
-            #
-            """.format(intersection_file=intersection_file_fn)
-        ) + cmd,
-        file=makefile_fo,
-    )
+    makefile_fo.write(ASSEMBLY_HEADER_TPL.format(intersection_file=intersection_file_fn) + cmd + "\n")
 
 
 class TreeIndex:
@@ -201,6 +208,17 @@ class TreeIndex:
         self.makefile_fn = makefile_fn
         pro.makedirs(self.index_dir)
 
+        # file names are composed once per node (every node is used both as a child and as a parent)
+        self._nonreduced_fasta_fns = {}
+        self._reduced_fasta_fns = {}
+        self._count_fns = {}
+        index_dir_prefix = os.path.join(self.index_dir, "")
+        for node in self.tree.traverse():
+            prefix = index_dir_prefix + node.name
+            self._nonreduced_fasta_fns[node.name] = prefix + ".full.fa"
+            self._reduced_fasta_fns[node.name] = prefix + ".reduced.fa"
+            self._count_fns[node.name] = prefix + ".count.tsv"
+
     @staticmethod
     def _node_debug(node):
         if hasattr(node, "common_name") and node.common_name != "":
@@ -216,7 +234,7 @@ class TreeIndex:
         Args:
             node: Node of the tree.
         """
-        return os.path.join(self.index_dir, node.name + ".full.fa")
+        return self._nonreduced_fasta_fns[node.name]
 
     def reduced_fasta_fn(self, node):
         """Get name of the reduced FASTA file (k-mer propagation).
@@ -224,7 +242,7 @@ class TreeIndex:
         Args:
             node: Node of the tree.
         """
-        return os.path.join(self.index_dir, node.name + ".reduced.fa")
+        return self._reduced_fasta_fns[node.name]
 
     def count_fn(self, node):
         """Get FASTA name of the file with k-mer counts.
@@ -232,10 +250,32 @@ class TreeIndex:
         Args:
             node: Node of the tree.
         """
-        return os.path.join(self.index_dir, node.name + ".count.tsv")
+        return self._count_fns[node.name]
 
     def process_node(self, node, makefile_fo):
-        """Recursive function for treating an individual node of the tree.
+        """Print rules for a subtree (children before their parents).
+
+        The tree is traversed in post-order using an explicit stack (deep trees
+        do not hit the recursion limit).
+
+        Args:
+            node: Root of the subtree.
+            makefile_fo: Output file.
+        """
+
+        # stack of (node, iterator over its remaining children)
+        stack = [(node, iter(node.get_children()))]
+        while stack:
+            current_node, children_it = stack[-1]
+            child = next(children_it, None)
+            if child is not None:
+                stack.append((child, iter(child.get_children())))
+            else:
+                stack.pop()
+                self.process_single_node(current_node, makefile_fo=makefile_fo)
+
+    def process_single_node(self, node, makefile_fo):
+        """Print rules for an individual node of the tree (its children must be already processed).
 
         Args:
             node: Node of the tree.
@@ -253,12 +293,7 @@ class TreeIndex:
         else:
             children = node.get_children()
 
-            # 1) process children
-            for child in children:
-                self.process_node(child, makefile_fo=makefile_fo)
-            # print(child.name, "processed",file=sys.stderr)
-
-            # 2) k-mer propagation & assembly
+            # k-mer propagation & assembly
             input_files = [self.nonreduced_fasta_fn(x) for x in children]
             output_files = [self.reduced_fasta_fn(x) for x in children]
             intersection_file = self.nonreduced_fasta_fn(node)
@@ -274,8 +309,9 @@ class TreeIndex:
 
         nodes, leaves = tree_size(self.tree)
 
-        with open(self.makefile_fn, 'w+') as f:
-            print(
+        # large buffer: the rules are written by many small writes
+        with open(self.makefile_fn, 'w+', buffering=2**20) as f:
+            f.write(
                 textwrap.dedent(
                     """\
                     include params.mk\n
@@ -359,7 +395,7 @@ class TreeIndex:
                         leaves=leaves,
                         internal_nodes=nodes - leaves,
                     )
-                ), file=f
+                ) + "\n"
             )
 
             self.process_node(self.tree.get_tree_root(), makefile_fo=f)
@@ -10,12 +10,13 @@ import datetime
 import ete3
 import json
 import os
-import pathlib
 import psutil
 import shutil
+import stat
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import gzip
 
@@ -24,6 +25,8 @@ import gzip
 ###########
 
 log_file = None
+# messages can be printed from several threads (e.g., parallel downloads)
+log_lock = threading.Lock()
 
 
 def open_gzip(fn):
@@ -92,12 +95,13 @@ def message(*msg, subprogram='', upper=False, only_log=False):
 
     log_line = '[prophyle{}] {} {}'.format(subprogram, fdt, " ".join(msg))
 
-    if not only_log:
-        print(log_line, file=sys.stderr)
-    if log_file is not None:
-        log_file.write(log_line)
-        log_file.write("\n")
-        log_file.flush()
+    with log_lock:
+        if not only_log:
+            print(log_line, file=sys.stderr)
+        if log_file is not None:
+            log_file.write(log_line)
+            log_file.write("\n")
+            log_file.flush()
 
 
 ###################
@@ -378,13 +382,22 @@ def test_files(*fns, test_nonzero=False, allow_pipes=False):
         test_nonzero (bool): Test if files have size greater than zero.
         allow_pipes (bool): Allow Unix pipes as input and don't test size.
 
+    Returns:
+        tuple(int): File sizes (obtained from the same stat call).
+
     Raises:
         AssertionError: File does not exist or it is empty.
     """
 
+    sizes = []
     for fn in fns:
-        is_file = os.path.isfile(fn)
-        is_pipe = pathlib.Path(fn).is_fifo()
+        # a single stat call for the type and the size
+        try:
+            st = os.stat(fn)
+        except OSError:
+            st = None
+        is_file = st is not None and stat.S_ISREG(st.st_mode)
+        is_pipe = st is not None and stat.S_ISFIFO(st.st_mode)
         if allow_pipes:
             assert is_file or is_pipe, 'File "{}" does not exist.'.format(fn)
         else:
@@ -394,7 +407,10 @@ def test_files(*fns, test_nonzero=False, allow_pipes=False):
                 assert is_file, 'File "{}" does not exist.'.format(fn)
 
         if test_nonzero and not allow_pipes:
-            assert file_sizes(fn)[0], 'File "{}" has size 0.'.format(fn)
+            assert st.st_size, 'File "{}" has size 0.'.format(fn)
+        sizes.append(st.st_size)
+
+    return tuple(sizes)
 
 
 ########
@@ -402,6 +418,45 @@ def test_files(*fns, test_nonzero=False, allow_pipes=False):
 ########
 
 
+def cpu_count():
+    """Get the number of CPUs usable by the current process.
+
+    The CPU affinity mask (taskset, SLURM cpusets, etc.) and the CPU quota of the cgroup (containers) are respected.
+
+    Returns:
+        int: Number of CPUs.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota, period = None, None
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = f.read().strip()
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = f.read().strip()
+        except OSError:
+            pass
+
+    try:
+        quota, period = int(quota), int(period)
+        if quota > 0 and period > 0:
+            cpus = min(cpus, max(1, -(-quota // period)))
+    except (TypeError, ValueError):
+        # no quota ("max", "-1" or no cgroup)
+        pass
+
+    return cpus
+
+
 def run_safe(command, output_fn=None, output_fo=None, err_msg=None, thr_exc=True, silent=False):
     """Run a shell command safely.
 